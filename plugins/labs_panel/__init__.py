@@ -142,13 +142,16 @@ class LabsPanel(foo.Panel):
         # Dropdown for installation
         menu = panel.menu("menu", variant="square", color="secondary")
         dropdown = types.DropdownView()
-        plugins = ctx.panel.get_state("table")
-        for p in plugins:
+        selection = ctx.panel.state.selection
+        selected = None
+        for p in ctx.panel.get_state("table"):
             dropdown.add_choice(
                 p["name"],
                 label=f"{p['name']}",
                 description=p["description"],
             )
+            if p["name"] == selection:
+                selected = p
 
         menu.str(
             "dropdown",
@@ -157,28 +160,30 @@ class LabsPanel(foo.Panel):
             on_change=self.alter_selection,
         )
 
-        for p in plugins:
-            if ctx.panel.state.selection == p["name"]:
-                ctx.panel.state.plugin_url = p["url"]
-                menu.btn(
-                    f"{p['name']}_install",
-                    label="Install",
-                    on_click=self.install_plugin,
-                    color="51",
-                )
+        if selected is not None:
+            ctx.panel.state.plugin_url = selected["url"]
+            menu.btn(
+                f"{selected['name']}_install",
+                label="Install",
+                on_click=self.install_plugin,
+                color="51",
+            )
+            menu.btn(
+                f"{selected['name']}_info",
+                label="Learn More",
+                on_click=self.show_url,
+                color="51",
+            )
+            if (
+                selected.get("curr_version")
+                and selected["name"] != "@51labs/labs_panel"
+            ):
                 menu.btn(
-                    f"{p['name']}_info",
-                    label="Learn More",
-                    on_click=self.show_url,
+                    f"{selected['name']}_uninstall",
+                    label="Uninstall",
+                    on_click=self.uninstall_plugin,
                     color="51",
                 )
-                if p.get("curr_version") and p["name"] != "@51labs/labs_panel":
-                    menu.btn(
-                        f"{p['name']}_uninstall",
-                        label="Uninstall",
-                        on_click=self.uninstall_plugin,
-                        color="51",
-                    )
 
         return types.Property(
             panel,
@@ -1,13 +1,43 @@
+import html
+import json
 import logging
+import os
 import re
-from bs4 import BeautifulSoup
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import fiftyone.constants as foc
 from fiftyone.utils.github import GitHubRepository
 import fiftyone.plugins.utils as fopu
 import fiftyone.plugins.core as fopc
 
 PLUGIN_METADATA_FILENAMES = ("fiftyone.yml", "fiftyone.yaml")
 
+# Parsed README features are cached in memory and on disk for this long
+FEATURES_CACHE_TTL = 600
+FEATURES_CACHE_PATH = os.path.join(
+    foc.FIFTYONE_CONFIG_DIR, "cache", "labs_features.json"
+)
+
+# Table rows with exactly two cells: the linked feature and its description
+_ROW_RE = re.compile(
+    r"<tr\b[^>]*>((?:(?!</tr\s*>).)*)</tr\s*>", re.DOTALL | re.IGNORECASE
+)
+_CELL_RE = re.compile(
+    r"<td\b[^>]*>((?:(?!</td\s*>).)*)</td\s*>", re.DOTALL | re.IGNORECASE
+)
+_HREF_RE = re.compile(
+    r"<a\b[^>]*?(?<![\w-])href\s*=\s*"
+    r"(?:\"(?P<dq>[^\"]*)\"|'(?P<sq>[^']*)'|(?P<uq>[^\s>]+))",
+    re.IGNORECASE,
+)
+_TAG_RE = re.compile(r"<[^>]+>")
+_TABLE_START_RE = re.compile(r"<table\b", re.IGNORECASE)
+_TABLE_END_RE = re.compile(r"</table\s*>", re.IGNORECASE)
+
+_features_cache = None
+_labs_repo = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -16,6 +46,9 @@ def list_labs_features(info=False):
     `FiftyOne Labs repository <https://github.com/voxel51/labs>`_
     README.
 
+    The features parsed from the README are cached in memory and in
+    ``FEATURES_CACHE_PATH`` for ``FEATURES_CACHE_TTL`` seconds.
+
     Args:
         info (False): whether to retrieve full plugin info for each plugin
             (True) or just return the available info from the README (False)
@@ -23,66 +56,128 @@ def list_labs_features(info=False):
     Returns:
         a list of dicts describing the features
     """
+    plugins = _get_cached_features()
+    if plugins is None:
+        plugins = _parse_labs_features()
+        _set_cached_features(plugins)
 
-    repo = GitHubRepository("https://github.com/voxel51/labs")
-    content = repo.get_file("README.md").decode()
+    if not info or not plugins:
+        return plugins
 
-    # Find h2 headings (##) in the readme
-    h2_pattern = r"^## (.+)$"
-    headings = []
-    for match in re.finditer(h2_pattern, content, re.MULTILINE):
-        headings.append(
-            {"h2_heading": match.group(1), "h2_position": match.start()}
-        )
+    # Plugin info is fetched from GitHub, so requests are made in parallel
+    urls = [p["url"] for p in plugins]
+    max_workers = min(16, len(urls))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_get_plugin_info, urls))
 
-    # Find tables in the readme
-    table_pattern = r"<table>.*?</table>"
-    tables = []
-    for match in re.finditer(table_pattern, content, re.DOTALL):
-        tables.append(
-            {"table_content": match.group(0), "table_position": match.start()}
-        )
 
+def _get_plugin_info(url):
+    return fopu.get_plugin_info(url, None)
+
+
+def _get_cached_features():
+    global _features_cache
+
+    if _features_cache is not None:
+        timestamp, plugins = _features_cache
+        if time.monotonic() - timestamp < FEATURES_CACHE_TTL:
+            return [dict(p) for p in plugins]
+
+    try:
+        age = time.time() - os.path.getmtime(FEATURES_CACHE_PATH)
+        if age >= FEATURES_CACHE_TTL:
+            return None
+
+        with open(FEATURES_CACHE_PATH, "r") as f:
+            plugins = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    _features_cache = (time.monotonic() - age, plugins)
+    return [dict(p) for p in plugins]
+
+
+def _set_cached_features(plugins):
+    global _features_cache
+
+    plugins = [dict(p) for p in plugins]
+    _features_cache = (time.monotonic(), plugins)
+
+    tmp_path = FEATURES_CACHE_PATH + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(FEATURES_CACHE_PATH), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(plugins, f)
+
+        os.replace(tmp_path, FEATURES_CACHE_PATH)
+    except OSError as e:
+        logger.debug("Failed to cache Labs features: %s", e)
+
+
+def _get_labs_repo():
+    global _labs_repo
+
+    if _labs_repo is None:
+        _labs_repo = GitHubRepository("https://github.com/voxel51/labs")
+
+    return _labs_repo
+
+
+def _parse_labs_features():
+    content = _get_labs_repo().get_file("README.md").decode()
+
+    # Single pass over the readme that only collects the lines of <table>
+    # blocks, which are attributed to the preceding h2 heading (##)
+    plugins = []
+    category = None
+    table_lines = None
+    for line in content.splitlines():
+        if table_lines is None:
+            if line.startswith("## "):
+                category = line[3:]
+                continue
+
+            if category is None or not _TABLE_START_RE.search(line):
+                continue
+
+            table_lines = []
+
+        table_lines.append(line)
+        if _TABLE_END_RE.search(line):
+            plugins.extend(_parse_table("\n".join(table_lines), category))
+            table_lines = None
+
+    return plugins
+
+
+def _parse_table(table, category):
     plugins = []
-    for i, heading in enumerate(headings):
-        heading_text = heading["h2_heading"]
-        heading_pos = heading["h2_position"]
-
-        next_heading_pos = (
-            headings[i + 1]["h2_position"]
-            if i + 1 < len(headings)
-            else len(content)
+    for row in _ROW_RE.findall(table):
+        # Plugin rows have exactly two cells: name and description
+        cells = _CELL_RE.findall(row)
+        if len(cells) != 2:
+            continue
+
+        name, description = cells
+        href = _HREF_RE.search(name)
+        if href is None:
+            logger.debug("Skipping unlinked plugin row")
+            continue
+
+        plugins.append(
+            dict(
+                name=_get_text(name),
+                url=html.unescape(href["dq"] or href["sq"] or href["uq"]),
+                description=_get_text(description),
+                category=category,
+            )
         )
 
-        for table in tables:
-            if heading_pos < table["table_position"] < next_heading_pos:
-                soup = BeautifulSoup(table["table_content"], "html.parser")
-                table_elem = soup.find("table")
-
-                for row in table_elem.find_all("tr"):
-                    cols = row.find_all(["td"])
-                    if len(cols) != 2:
-                        continue
-
-                    try:
-                        name = cols[0].text.strip()
-                        url = cols[0].find("a")["href"]
-                        description = cols[1].text.strip()
-                        plugins.append(
-                            dict(
-                                name=name,
-                                url=url,
-                                description=description,
-                                category=heading_text,
-                            )
-                        )
-                    except Exception as e:
-                        logger.debug("Failed to parse plugin row: %s", e)
-
-    if not info:
-        return plugins
+    return plugins
+
 
-    return [fopu.get_plugin_info(p["url"], None) for p in plugins]
+def _get_text(cell):
+    return html.unescape(_TAG_RE.sub("", cell)).strip()
 
 
 def add_version_info_to_features(lab_features):
@@ -61,6 +61,17 @@ class VideoApplyModel(foo.Operator):
             required=False,
         )
 
+        inputs.int(
+            "num_writer_threads",
+            label="Num Writer Threads",
+            description=(
+                "The number of threads to use when saving predictions to "
+                "the database"
+            ),
+            required=False,
+            default=4,
+        )
+
         inputs.int(
             "frames_chunk_size",
             label="Chunk size for video frames",
@@ -94,6 +105,7 @@ class VideoApplyModel(foo.Operator):
         conf_thresh = ctx.params.get("conf_thresh", None)
         batch_size = ctx.params.get("batch_size", None)
         num_workers = ctx.params.get("num_workers", None)
+        num_writer_threads = ctx.params.get("num_writer_threads", None) or 4
         frames_chunk_size = ctx.params.get("frames_chunk_size", None)
         skip_failures = ctx.params.get("skip_failures", True)
 
@@ -105,6 +117,7 @@ class VideoApplyModel(foo.Operator):
             batch_size=batch_size,
             frames_chunk_size=frames_chunk_size,
             num_workers=num_workers,
+            num_writer_threads=num_writer_threads,
             skip_failures=skip_failures,
             progress=None,
         )
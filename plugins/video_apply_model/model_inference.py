@@ -1,9 +1,11 @@
 """Video decoding and dataloading for FiftyOne model inference."""
 
 import contextlib
+import itertools
 import logging
 import numpy as np
-from collections import OrderedDict
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import eta.core.video as etav
 import fiftyone as fo
@@ -21,11 +23,14 @@ torch = fou.lazy_import("torch")
 tud = fou.lazy_import("torch.utils.data")
 tcd = fou.lazy_import("torchcodec.decoders")
 
-# Video decoder cache
+# Video decoder cache, in least to most recently used order
 _worker_decoder_cache = None
-_worker_iterator_cache = None
 DECODER_CACHE_SIZE = 1
 
+# torchcodec decodes chunks of frames in a single call; FFmpegVideoReader is
+# used as a fallback when it cannot be imported
+_has_torchcodec = None
+
 
 def apply_image_model_to_video_frames(
     samples: fo.core.collections.SampleCollection,
@@ -35,6 +40,10 @@ def apply_image_model_to_video_frames(
     batch_size=None,
     frames_chunk_size=None,
     num_workers=None,
+    num_writer_threads=4,
+    prefetch_factor=None,
+    batch_transform=False,
+    gpu_decode=False,
     skip_failures=True,
     progress=None,
 ):
@@ -52,6 +61,19 @@ def apply_image_model_to_video_frames(
         batch_size (None): number of videos to process as a batch
         frames_chunk_size (None): number of frames in one chunk
         num_workers (None): the number of workers to use when loading videos
+        num_writer_threads (4): the number of threads to use when saving
+            predictions to the database
+        prefetch_factor (None): the number of chunks to load in advance by
+            each worker. Only applicable when ``num_workers > 0``
+        batch_transform (False): whether the model's transforms accept
+            ``(N, C, H, W)`` uint8 tensors of frames, like torchvision v2
+            transforms, and can thus be applied once per chunk rather than
+            to each ``(H, W, C)`` frame
+        gpu_decode (False): whether to decode frames with torchcodec on the
+            model's CUDA device. Only enable this if the model (or its
+            batched transforms) accepts ``(N, H, W, C)`` uint8 CUDA tensors
+            of frames. Requires torchcodec and loading data in the main
+            process, so ``num_workers`` defaults to 0 in this case
         skip_failures (True): whether to gracefully continue without raising an
             error if predictions cannot be generated for a sample. Only
             applicable to :class:`Model` instances
@@ -76,6 +98,9 @@ def apply_image_model_to_video_frames(
         batch_size=batch_size,
         num_workers=num_workers,
         frames_chunk_size=frames_chunk_size,
+        prefetch_factor=prefetch_factor,
+        batch_transform=batch_transform,
+        gpu_decode=gpu_decode,
         skip_failures=skip_failures,
     )
 
@@ -94,72 +119,265 @@ def apply_image_model_to_video_frames(
             fou.ProgressBar(data_loader, progress=progress)
         )
         context.enter_context(fou.SetAttributes(model, preprocess=False))
+        writer = context.enter_context(
+            _FrameLabelsWriter(
+                samples,
+                label_field,
+                confidence_thresh=confidence_thresh,
+                num_threads=num_writer_threads,
+            )
+        )
 
         for batch in pb(data_loader):
             for frames in batch:
                 labels_frames = model.predict_all(frames["frames"])
-                sample_idx = frames["sample_idx"]
-                sample = samples[sample_idx]
 
                 fns = frames["frame_ids"]
-                sample.add_labels(
+                writer.add_labels(
+                    frames["sample_idx"],
                     {
                         int(fn): labels
                         for fn, labels in zip(fns, labels_frames)
                     },
-                    label_field=label_field,
-                    confidence_thresh=confidence_thresh,
                 )
-                sample.save()
+
+
+class _FrameLabelsWriter(object):
+    """Context manager that accumulates frame labels for samples and saves
+    them in batches in background threads, so that database writes overlap
+    with inference.
+
+    Args:
+        samples: a :class:`fiftyone.core.collections.SampleCollection`
+        label_field: the frame field in which to store the labels
+        confidence_thresh (None): an optional confidence threshold to apply
+            to the labels
+        num_threads (4): the number of threads to use to save samples
+        flush_every (64): the number of samples whose labels to accumulate
+            before saving them in a single batch
+        max_pending_frames (1024): the number of frames whose labels to
+            accumulate before saving them, regardless of ``flush_every``.
+            This bounds memory usage and the predictions lost on failure
+            for datasets with few, long videos
+    """
+
+    def __init__(
+        self,
+        samples,
+        label_field,
+        confidence_thresh=None,
+        num_threads=4,
+        flush_every=64,
+        max_pending_frames=1024,
+    ):
+        self.samples = samples
+        self.label_field = label_field
+        self.confidence_thresh = confidence_thresh
+        self.num_threads = num_threads
+        self.flush_every = flush_every
+        self.max_pending_frames = max_pending_frames
+
+        self._executor = None
+        self._slots = None
+        self._pending = {}
+        self._num_pending_frames = 0
+        self._futures = {}
+        self._futures_lock = threading.Lock()
+        self._first_save_done = False
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.num_threads)
+
+        # Bounds the number of pending saves so they can't pile up behind
+        # inference
+        self._slots = threading.Semaphore(2 * self.num_threads)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._flush()
+            with self._futures_lock:
+                futures = set(self._futures.values())
+
+            for future in futures:
+                future.result()
+        except Exception as e:
+            if exc_type is None:
+                raise
+
+            # Don't mask the original error
+            logger.warning("Failed to save pending predictions: %s", e)
+        finally:
+            self._executor.shutdown(wait=True)
+            self._pending.clear()
+            self._futures.clear()
+
+    def add_labels(self, sample_id, frame_labels):
+        """Adds the given frame labels to a sample. The sample is saved once
+        labels for ``flush_every`` samples or ``max_pending_frames`` frames
+        have been accumulated.
+
+        Args:
+            sample_id: the ID of the sample
+            frame_labels: a dict mapping frame numbers to labels
+        """
+        self._pending.setdefault(sample_id, {}).update(frame_labels)
+        self._num_pending_frames += len(frame_labels)
+
+        if (
+            len(self._pending) >= self.flush_every
+            or self._num_pending_frames >= self.max_pending_frames
+        ):
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        # A sample must not be reloaded while a previous save is in flight
+        for sample_id in self._pending:
+            with self._futures_lock:
+                future = self._futures.pop(sample_id, None)
+
+            if future is not None:
+                future.result()
+
+        # Load the samples in a single query
+        view = self.samples.select(list(self._pending))
+        samples_by_id = {sample.id: sample for sample in view.iter_samples()}
+
+        batch = []
+        for sample_id, frame_labels in self._pending.items():
+            sample = samples_by_id[sample_id]
+            sample.add_labels(
+                frame_labels,
+                label_field=self.label_field,
+                confidence_thresh=self.confidence_thresh,
+            )
+            batch.append(sample)
+
+        self._pending = {}
+        self._num_pending_frames = 0
+
+        self._slots.acquire()
+        future = self._executor.submit(self._save_samples, batch)
+        with self._futures_lock:
+            for sample in batch:
+                self._futures[sample.id] = future
+
+        sample_ids = [sample.id for sample in batch]
+        future.add_done_callback(
+            lambda future: self._on_saved(sample_ids, future)
+        )
+
+        if not self._first_save_done:
+            # The first save may expand the frame schema of the dataset, so
+            # it must complete before saves run concurrently
+            future.result()
+            self._first_save_done = True
+
+    def _on_saved(self, sample_ids, future):
+        self._slots.release()
+
+        # Failed saves are kept so that their errors are raised later
+        if future.exception() is not None:
+            return
+
+        with self._futures_lock:
+            for sample_id in sample_ids:
+                if self._futures.get(sample_id) is future:
+                    del self._futures[sample_id]
+
+    def _save_samples(self, batch):
+        # The save context issues bulk writes rather than one per sample
+        with self.samples.save_context() as context:
+            for sample in batch:
+                context.save(sample)
 
 
 def worker_init_fn(worker_id):
-    global _worker_decoder_cache, _worker_iterator_cache
-    _worker_decoder_cache = OrderedDict()
-    _worker_iterator_cache = OrderedDict()
+    global _worker_decoder_cache
+    _worker_decoder_cache = {}
     logger.debug(f"Worker {worker_id} initialized with empty decoder cache.")
 
 
-def _get_cached_decoder(video_path, max_cached):
-    global _worker_decoder_cache, _worker_iterator_cache
+def _get_cached_decoder(video_path, max_cached, device="cpu"):
+    global _worker_decoder_cache
 
     if _worker_decoder_cache is None:
-        _worker_decoder_cache = OrderedDict()
-        _worker_iterator_cache = OrderedDict()
-
-    if video_path in _worker_decoder_cache:
-        _worker_decoder_cache.move_to_end(video_path)
-        _worker_iterator_cache.move_to_end(video_path)
-        return (
-            _worker_decoder_cache[video_path],
-            _worker_iterator_cache[video_path],
-        )
+        _worker_decoder_cache = {}
+
+    decoder = _worker_decoder_cache.get(video_path)
+    if decoder is not None:
+        # Reinsert as most recently used, unless it is the only entry
+        if len(_worker_decoder_cache) > 1:
+            del _worker_decoder_cache[video_path]
+            _worker_decoder_cache[video_path] = decoder
+
+        return decoder
 
-    decoder = etav.FFmpegVideoReader(video_path)
-    iterator = iter(decoder)
+    decoder = _make_decoder(video_path, device=device)
     _worker_decoder_cache[video_path] = decoder
-    _worker_iterator_cache[video_path] = iterator
 
     if len(_worker_decoder_cache) > max_cached:
         _del_decoder()
 
-    return decoder, iterator
+    return decoder
+
+
+def _torchcodec_available():
+    global _has_torchcodec
+
+    if _has_torchcodec is None:
+        # torchcodec may be installed but fail to import, for example when
+        # FFmpeg libraries are missing or its version doesn't match torch
+        try:
+            import torchcodec.decoders  # pylint: disable=unused-import
+
+            _has_torchcodec = True
+        except Exception as e:
+            logger.debug("torchcodec is unavailable: %s", e)
+            _has_torchcodec = False
+
+    return _has_torchcodec
+
+
+def _make_decoder(video_path, device="cpu"):
+    if _torchcodec_available():
+        try:
+            return tcd.VideoDecoder(
+                video_path, dimension_order="NHWC", device=device
+            )
+        except Exception as e:
+            # e.g. the container does not report a frame count
+            logger.debug(
+                "Falling back to FFmpegVideoReader for '%s': %s",
+                video_path,
+                e,
+            )
+
+    return etav.FFmpegVideoReader(video_path)
+
+
+def _close_decoder(decoder):
+    # torchcodec decoders release their resources when garbage collected
+    if isinstance(decoder, etav.FFmpegVideoReader):
+        decoder.close()
 
 
 def _del_decoder(video_path=None):
-    global _worker_decoder_cache, _worker_iterator_cache
+    global _worker_decoder_cache
 
     if not _worker_decoder_cache:
         return
 
-    if video_path:
-        _decoder = _worker_decoder_cache.pop(video_path)
-        _decoder.close()
-        del _worker_iterator_cache[video_path]
-    else:
-        video_path, old_decoder = _worker_decoder_cache.popitem(last=False)
-        old_decoder.close()
-        del _worker_iterator_cache[video_path]
+    if not video_path:
+        video_path = next(iter(_worker_decoder_cache))
+
+    _decoder = _worker_decoder_cache.pop(video_path)
+
+    _close_decoder(_decoder)
     logger.debug(f"Decoder cache deleted for {video_path}.")
 
 
@@ -170,9 +388,16 @@ def _make_video_frame_data_loader(
     num_workers,
     frames_chunk_size,
     skip_failures,
+    prefetch_factor=None,
+    batch_transform=False,
+    gpu_decode=False,
 ):
     use_numpy = not isinstance(model, TorchModelMixin)
-    num_workers = fout.recommend_num_workers(num_workers)
+
+    if gpu_decode and num_workers is None:
+        num_workers = 0
+    else:
+        num_workers = fout.recommend_num_workers(num_workers)
 
     if batch_size is None:
         batch_size = 1
@@ -184,14 +409,40 @@ def _make_video_frame_data_loader(
         user_collate_fn=_make_video_collate(model.collate_fn),
     )
 
+    using_gpu = isinstance(model, fout.TorchImageModel) and model._using_gpu
+
+    decode_device = "cpu"
+    if gpu_decode:
+        if not _torchcodec_available():
+            logger.warning("GPU decoding requires torchcodec; using CPU")
+        elif not using_gpu:
+            logger.warning("GPU decoding requires a GPU model; using CPU")
+        elif model.transforms is not None and not batch_transform:
+            # Per-frame transforms run on CPU arrays
+            logger.warning(
+                "GPU decoding requires batch_transform=True when the model "
+                "has transforms; using CPU"
+            )
+        elif num_workers > 0:
+            # CUDA cannot be initialized in forked workers
+            logger.warning("GPU decoding requires num_workers=0; using CPU")
+        else:
+            decode_device = str(model.device)
+
     dataset = TorchVideoFramesDataset(
         samples=samples,
         transform=model.transforms,
+        batch_transform=batch_transform,
         include_ids=True,
         chunk_size=frames_chunk_size,
         skip_failures=skip_failures,
+        decode_device=decode_device,
     )
-    pin_memory = isinstance(model, fout.TorchImageModel) and model._using_gpu
+    pin_memory = using_gpu and decode_device == "cpu"
+
+    kwargs = {}
+    if num_workers > 0 and prefetch_factor is not None:
+        kwargs["prefetch_factor"] = prefetch_factor
 
     return tud.DataLoader(
         dataset,
@@ -199,8 +450,9 @@ def _make_video_frame_data_loader(
         num_workers=num_workers,
         collate_fn=collate_fn,
         pin_memory=pin_memory,
-        persistent_workers=False,
+        persistent_workers=num_workers > 0,
         worker_init_fn=worker_init_fn,
+        **kwargs,
     )
 
 
@@ -208,14 +460,46 @@ def _make_video_collate(model_collate):
     def _video_collate_fn(batch):
         for b in batch:
             frames_data = b["frames"]
-            collated_frames = model_collate(frames_data)
-            b["frames"] = collated_frames
+            if isinstance(frames_data, torch.Tensor):
+                # Chunks from batch transforms or GPU decoding are already
+                # batched
+                continue
+
+            b["frames"] = model_collate(frames_data)
         return batch
 
     return _video_collate_fn
 
 
 class TorchVideoFramesDataset(tud.IterableDataset):
+    """An iterable dataset that yields chunks of decoded video frames.
+
+    Each chunk is a dict with the ``"frames"`` of the chunk, the
+    ``"frame_ids"`` of those frames, and the ``"sample_idx"`` of the video.
+
+    Args:
+        video_paths (None): a list of video paths
+        samples (None): a
+            :class:`fiftyone.core.collections.SampleCollection` from which to
+            load the video paths
+        sample_ids (None): a list of sample IDs for the videos
+        include_ids (False): whether to load the sample IDs from ``samples``
+        transform (None): an optional transform to apply to the frames
+        batch_transform (False): whether ``transform`` is applied once per
+            chunk to a ``(N, C, H, W)`` uint8 tensor, like torchvision v2
+            transforms, rather than to each ``(H, W, C)`` frame
+        chunk_size (None): the number of frames in each chunk
+        skip_failures (False): whether to gracefully continue without raising
+            an error on failures
+        max_cached_decoders (8): the maximum number of video decoders to
+            cache per worker
+        decode_device ("cpu"): the device on which to decode frames. Decoding
+            on a CUDA device requires torchcodec, and is only supported when
+            loading data in the main process. Untransformed chunks decoded on
+            a CUDA device are yielded as ``(N, H, W, C)`` uint8 tensors rather
+            than lists of ``(H, W, C)`` numpy arrays
+    """
+
     def __init__(
         self,
         video_paths=None,
@@ -223,12 +507,16 @@ class TorchVideoFramesDataset(tud.IterableDataset):
         sample_ids=None,
         include_ids=False,
         transform=None,
+        batch_transform=False,
         chunk_size=None,
         skip_failures=False,
         max_cached_decoders=8,
+        decode_device="cpu",
     ):
         self.chunk_size = chunk_size if chunk_size is not None else 1
         self.max_cached_decoders = max_cached_decoders
+        self.decode_device = decode_device
+        self._base_ids = np.arange(1, self.chunk_size + 1, dtype=np.int64)
 
         video_paths, sample_ids = self._parse_inputs(
             video_paths=video_paths,
@@ -240,6 +528,7 @@ class TorchVideoFramesDataset(tud.IterableDataset):
         self.video_paths = video_paths
         self.sample_ids = sample_ids
         self.transform = transform
+        self.batch_transform = batch_transform
         self.skip_failures = skip_failures
 
     def _parse_inputs(
@@ -276,46 +565,124 @@ class TorchVideoFramesDataset(tud.IterableDataset):
 
             logger.info(
                 f"Worker {worker_id}/{num_workers} assigned "
-                f"{len(list(video_indices))} videos"
+                f"{len(video_indices)} videos"
             )
 
         for video_idx in video_indices:
             video_path = self.video_paths[video_idx]
             sample_id = self.sample_ids[video_idx] if self.sample_ids else None
 
-            _, iterator = _get_cached_decoder(
-                video_path, self.max_cached_decoders
+            decoder = _get_cached_decoder(
+                video_path,
+                self.max_cached_decoders,
+                device=self.decode_device,
             )
 
-            frames_chunk = []
-            frame_num = 0
-            for img in iterator:
-                frame = np.array(img)
-                if self.transform:
-                    frame = self.transform(frame)
-                frames_chunk.append(frame)
-                frame_num += 1
-
-                if len(frames_chunk) == self.chunk_size:
-                    yield {
-                        "frames": frames_chunk,
-                        "sample_idx": sample_id,
-                        "frame_ids": np.arange(
-                            frame_num - self.chunk_size, frame_num
-                        )
-                        + 1,
-                    }
-                    frames_chunk = []
-
-            if frames_chunk:
+            if isinstance(decoder, etav.FFmpegVideoReader):
+                chunks = self._iter_reader_chunks(decoder)
+            else:
+                chunks = self._iter_decoder_chunks(decoder, video_path)
+
+            for frames, frame_ids in chunks:
                 yield {
-                    "frames": frames_chunk,
+                    "frames": frames,
                     "sample_idx": sample_id,
-                    "frame_ids": np.arange(
-                        frame_num - len(frames_chunk), frame_num
-                    )
-                    + 1,
+                    "frame_ids": frame_ids,
                 }
 
             # Delete decoder from cache at the end of iteration.
             _del_decoder(video_path)
+
+    def _iter_decoder_chunks(self, decoder, video_path):
+        try:
+            num_frames = len(decoder)
+        except Exception:
+            num_frames = None
+
+        if not num_frames:
+            # The frame count is unknown, so read frames until EOF instead
+            logger.debug(
+                "Unknown frame count for '%s'; using FFmpegVideoReader",
+                video_path,
+            )
+            yield from self._iter_fallback_chunks(video_path)
+            return
+
+        for start in range(0, num_frames, self.chunk_size):
+            stop = min(start + self.chunk_size, num_frames)
+
+            try:
+                batch = decoder.get_frames_in_range(start, stop).data
+            except (IndexError, RuntimeError) as e:
+                if not self.skip_failures:
+                    raise
+
+                # The frame count may be inaccurate, so read the remaining
+                # frames until EOF instead
+                logger.warning(
+                    "Failed to decode frames %d-%d of '%s'; reading the rest "
+                    "of the video with FFmpegVideoReader: %s",
+                    start + 1,
+                    stop,
+                    video_path,
+                    e,
+                )
+                yield from self._iter_fallback_chunks(video_path, start=start)
+                return
+
+            frames = self._transform_chunk(batch)
+
+            yield frames, self._base_ids[: stop - start] + start
+
+    def _iter_fallback_chunks(self, video_path, start=0):
+        with etav.FFmpegVideoReader(video_path) as reader:
+            yield from self._iter_reader_chunks(reader, start=start)
+
+    def _iter_reader_chunks(self, reader, start=0):
+        frames_buffer = None
+        num_buffered = 0
+        for img in itertools.islice(reader, start, None):
+            # Frames are copied into the buffer, so no copy is needed here
+            frame = np.asarray(img)
+            if frames_buffer is None:
+                logger.debug(
+                    "Reader yields %s frames",
+                    "ndarray" if isinstance(img, np.ndarray) else type(img),
+                )
+                frames_buffer = np.empty(
+                    (self.chunk_size,) + frame.shape, dtype=frame.dtype
+                )
+
+            frames_buffer[num_buffered] = frame
+            num_buffered += 1
+
+            if num_buffered == self.chunk_size:
+                yield self._buffered_chunk(frames_buffer, num_buffered, start)
+                start += num_buffered
+                num_buffered = 0
+
+        if num_buffered:
+            yield self._buffered_chunk(frames_buffer, num_buffered, start)
+
+    def _buffered_chunk(self, frames_buffer, num_frames, start):
+        # The buffer is overwritten by the next chunk, and transforms may
+        # return views of their inputs, so the chunk is always copied
+        frames = torch.from_numpy(frames_buffer[:num_frames].copy())
+        frames = self._transform_chunk(frames)
+
+        return frames, self._base_ids[:num_frames] + start
+
+    def _transform_chunk(self, frames):
+        # frames is a (N, H, W, C) uint8 tensor
+        if not self.transform:
+            if self.decode_device != "cpu":
+                # Opt-in GPU decoding keeps the frames on the device
+                return frames
+
+            # Models without transforms are collated from lists of frames
+            return list(frames.numpy())
+
+        if self.batch_transform:
+            return self.transform(frames.permute(0, 3, 1, 2))
+
+        return [self.transform(frame) for frame in frames.cpu().numpy()]